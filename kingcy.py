@@ -4,28 +4,46 @@ import json
 import random
 import os
 import asyncio
+import atexit
+import copy
+import functools
+import heapq
 import re
-from datetime import datetime, timedelta, timezone
+import signal
+import time
+import weakref
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
 
-# --- Web Server Imports (FOR RENDER HEALTH CHECK) ---
-from flask import Flask
-from threading import Thread
+from sortedcontainers import SortedList
+
+try:
+    import orjson
+except ImportError: # Fall back to the stdlib encoder if the wheel isn't installed
+    orjson = None
 
-# --- Flask Web Server Setup ---
-app = Flask(__name__)
+# --- Web Server Imports (FOR RENDER HEALTH CHECK) ---
+from aiohttp import web # Ships with discord.py
 
-@app.route('/')
-def home():
+# --- Health Check Server ---
+async def home(request):
     """Simple route for Render health check and Uptime Robot ping."""
-    return "Kingcy Bot is running and online!", 200
+    return web.Response(text="Kingcy Bot is running and online!")
 
-def run_flask_server():
-    """Starts the Flask web server."""
+async def start_web_server():
+    """Serves the health check on the bot's own event loop."""
+    app = web.Application()
+    app.router.add_get('/', home)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
     port = int(os.environ.get('PORT', 5000))
-    app.run(host='0.0.0.0', port=port)
+    await web.TCPSite(runner, '0.0.0.0', port).start()
+    return runner
 
 # --- Configuration ---
 TOKEN = os.getenv('DISCORD_TOKEN', 'YOUR_BOT_TOKEN_HERE') 
+DEBUG = os.getenv('KINGCY_DEBUG') == '1' # Pretty-print users.json for inspection
 CURRENCY_NAME = "Kingcy"
 CURRENCY_SYMBOL = "👑"
 
@@ -35,10 +53,23 @@ COMMAND_PREFIX = "king "
 DATA_FILE = "users.json"
 INITIAL_BALANCE = 500
 DAILY_REWARD = 200
+DAILY_COOLDOWN_SECONDS = 24 * 3600
 PRAY_REWARD_BASE = 50
 EXCLUDED_ROLE_ID = 1448197916656402483 # Role hidden from leaderboard & allowed to use 'claim'
 STEAL_COOLDOWN_MINUTES = 5 # Cooldown if caught stealing
 LUCK_PENALTY_MINUTES = 5 # Cooldown if caught stealing
+LEADERBOARD_SIZE = 10
+NAME_CACHE_SIZE = 256 # Leaderboard names kept for users who left the server
+NAME_CACHE_TTL = 600 # Seconds before a cached name is looked up again
+SAVE_INTERVAL = 2.0 # Seconds to coalesce changes before writing them out
+SAVE_BATCH_SIZE = 32 # Changed users that trigger a write before SAVE_INTERVAL is up
+WAL_FILE = "users.wal"
+SNAPSHOT_EVERY = 500 # WAL records before users.json is rewritten
+SNAPSHOT_INTERVAL = 300 # Seconds between users.json rewrites
+THREAD_POOL_SIZE = int(os.getenv('THREAD_POOL_SIZE', '2')) # Workers for asyncio.to_thread
+EPOCH_FIELDS = ("daily_last_claimed", "last_stole_date") # Stored as UNIX seconds
+REMINDERS_FILE = "reminders.json"
+MAX_REMINDERS_PER_USER = 20
 
 # Intents
 intents = discord.Intents.default()
@@ -48,14 +79,35 @@ intents.members = True
 # Remove default help to use our custom one
 bot = commands.Bot(command_prefix=COMMAND_PREFIX, intents=intents, help_command=None)
 
+# In-memory user table, loaded once at startup. This is the single source of
+# truth for every command; the JSON file is only written back to.
+users_data = {}
+
 # --- Helper Functions ---
 
+_CURRENCY_FMT = ("{} " + CURRENCY_SYMBOL).format
+_SUFFIXES = ((1_000_000_000, "B"), (1_000_000, "M"), (1_000, "k"))
+
+@functools.lru_cache(maxsize=1024)
 def format_currency(amount):
     """Formats the currency amount with short suffixes (k, M, B)."""
+    if type(amount) is int:
+        # Balances are ints, so round to one decimal without going through float
+        for threshold, suffix in _SUFFIXES:
+            if amount >= threshold:
+                tenths, rem = divmod(amount * 10, threshold)
+                if 2 * rem == threshold:
+                    break # Exact ties round like the float path below
+                if 2 * rem > threshold:
+                    tenths += 1
+                return _CURRENCY_FMT(f"{tenths // 10}.{tenths % 10}{suffix}")
+        else:
+            return _CURRENCY_FMT(amount)
+
     try:
         amount = float(amount)
     except:
-        return f"0 {CURRENCY_SYMBOL}"
+        return _CURRENCY_FMT(0)
 
     if amount >= 1_000_000_000:
         val = f"{amount / 1_000_000_000:.1f}B"
@@ -66,68 +118,304 @@ def format_currency(amount):
     else:
         val = f"{int(amount)}"
     
-    return f"{val} {CURRENCY_SYMBOL}"
+    return _CURRENCY_FMT(val)
+
+def _to_epoch(value):
+    """Converts a stored timestamp (epoch seconds or legacy ISO string) to whole epoch seconds."""
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        pass
+    try:
+        return int(datetime.fromisoformat(value).timestamp())
+    except (TypeError, ValueError):
+        return 0
+
+# --- Embed Templates ---
+# Static parts of the hottest responses. Commands shallow-copy a template and
+# only set description/footer, so templates must never get fields added.
+
+_BALANCE_EMBED = discord.Embed(color=0x00FF00)
+_BALANCE_TEXT = "💳 **{}**, you have **{}**".format
+_PRAY_EMBED = discord.Embed(color=0xFFFFFF)
+_SLOT_EMBED = discord.Embed(title="🎰 Slot Machine", description="🔄 Spinning...\n\n| ❓ | ❓ | ❓ |", color=0x3498db)
+_FLIP_WIN_EMBED = discord.Embed(title="🪙 Coin Flip", color=0x2ECC71)
+_FLIP_LOSS_EMBED = discord.Embed(title="🪙 Coin Flip", color=0xE74C3C)
+
+# --- JSON Encoding ---
+# Both backends take and return bytes. Snapshots are compact unless DEBUG is set.
+
+if orjson is not None:
+    _loads = orjson.loads
+    _dumps = orjson.dumps
+    _dumps_snapshot = functools.partial(orjson.dumps, option=orjson.OPT_INDENT_2 if DEBUG else 0)
+else:
+    _loads = json.loads
+    _compact_encode = json.JSONEncoder(separators=(',', ':')).encode
+    _snapshot_encode = json.JSONEncoder(indent=2).encode if DEBUG else _compact_encode
+
+    def _dumps(obj):
+        return _compact_encode(obj).encode()
+
+    def _dumps_snapshot(obj):
+        return _snapshot_encode(obj).encode()
 
 # --- Data Persistence ---
+# users.json is a periodic snapshot of the whole table. Between snapshots each
+# flush only appends the users that changed to WAL_FILE (one JSON record per
+# line), so a write costs O(changed users) instead of O(all users).
 
-async def load_data():
-    if not os.path.exists(DATA_FILE):
-        return {}
-    def _read():
-        with open(DATA_FILE, 'r') as f:
-            return json.load(f)
+def _read_data():
+    data = {}
+    snapshot_file = DATA_FILE
+    if not os.path.exists(snapshot_file):
+        # A crash between writing the temp snapshot and renaming it
+        snapshot_file = DATA_FILE + ".tmp"
+    if os.path.exists(snapshot_file):
+        try:
+            with open(snapshot_file, 'rb') as f:
+                data = _loads(f.read())
+        except:
+            data = {}
+    # Replay changes logged since the last snapshot
+    if os.path.exists(WAL_FILE):
+        good_bytes = 0
+        torn = False
+        with open(WAL_FILE, 'rb') as f:
+            for line in f:
+                try:
+                    # A record without its newline is torn too, even if it parses
+                    if not line.endswith(b"\n"):
+                        raise ValueError
+                    record = _loads(line)
+                except ValueError:
+                    torn = True # Torn write at the end of the log
+                    break
+                data[record["u"]] = record["d"]
+                good_bytes += len(line)
+        if torn:
+            # Cut the fragment off so new appends don't merge into it
+            try:
+                os.truncate(WAL_FILE, good_bytes)
+            except OSError as e:
+                print(f"Error truncating torn WAL: {e}")
+    # Cooldowns used to be stored as ISO-8601 strings
+    for user in data.values():
+        for key in EPOCH_FIELDS:
+            if key in user:
+                user[key] = _to_epoch(user[key])
+        # Prayers used to store a full timestamp; only the UTC day matters
+        if "last_pray_date" in user:
+            user["last_pray_day"] = _to_epoch(user.pop("last_pray_date")) // 86400
+    return data
+
+def load_data():
     try:
-        return await asyncio.to_thread(_read)
+        return _read_data()
     except:
         return {}
 
+def _write_snapshot(data):
+    tmp_file = DATA_FILE + ".tmp"
+    with open(tmp_file, 'wb') as f:
+        f.write(_dumps_snapshot(data))
+        f.flush()
+        os.fsync(f.fileno())
+    # Atomic swap: a crash leaves either the old or the new snapshot, never half of one
+    os.replace(tmp_file, DATA_FILE)
+    # Everything in the log is now part of the snapshot
+    os.ftruncate(_wal(), 0)
+
+_wal_fd = None
+
+def _wal():
+    """Returns the WAL's file descriptor, opening it for appending on first use."""
+    global _wal_fd
+    if _wal_fd is None:
+        _wal_fd = os.open(WAL_FILE, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    return _wal_fd
+
+def _append_wal(lines):
+    # The whole batch goes out in one write on a descriptor kept open between flushes
+    fd = _wal()
+    size = os.fstat(fd).st_size
+    buf = memoryview(b"".join(lines))
+    try:
+        while buf:
+            buf = buf[os.write(fd, buf):]
+    except OSError:
+        # Drop any partial batch so the retry doesn't append after a fragment
+        os.ftruncate(fd, size)
+        raise
+
 async def save_data(data):
-    def _write():
-        with open(DATA_FILE, 'w') as f:
-            json.dump(data, f, indent=4)
+    """Writes a full snapshot of the table and truncates the WAL."""
+    # Snapshot on the event loop so commands can keep mutating while the thread writes
+    snapshot = {uid: dict(user) for uid, user in data.items()}
     try:
-        await asyncio.to_thread(_write)
+        await asyncio.to_thread(_write_snapshot, snapshot)
     except Exception as e:
         print(f"Error saving data: {e}")
 
-async def ensure_user_data(user_id):
+# --- Coalesced Saving ---
+# Commands only mark users as dirty; a background task flushes them once per
+# SAVE_INTERVAL seconds (sooner once SAVE_BATCH_SIZE users are waiting), so a
+# burst of commands collapses into one write.
+
+# Created at import, before asyncio.run starts the loop: this relies on Python
+# 3.10+, where asyncio primitives bind to a loop on first use (.python-version)
+_dirty = asyncio.Event()
+_batch_full = asyncio.Event()
+_dirty_users = set()
+_save_lock = asyncio.Lock()
+_wal_records = 0
+_last_snapshot = time.monotonic()
+
+def schedule_save(*user_ids):
+    """Marks the given users as changed so the background saver logs them."""
+    _dirty_users.update(str(uid) for uid in user_ids)
+    _dirty.set()
+    if len(_dirty_users) >= SAVE_BATCH_SIZE:
+        _batch_full.set()
+
+async def flush_data():
+    """Appends unsaved users to the WAL, taking a snapshot when it grows too long."""
+    global _wal_records, _last_snapshot
+    async with _save_lock:
+        _dirty.clear()
+        _batch_full.clear()
+        if not _dirty_users:
+            return
+        changed = list(_dirty_users)
+        _dirty_users.clear()
+        lines = [_dumps({"u": uid, "d": users_data[uid]}) + b"\n" for uid in changed]
+        try:
+            await asyncio.to_thread(_append_wal, lines)
+        except Exception as e:
+            print(f"Error writing WAL: {e}")
+            # Keep them dirty so the next flush (or the exit snapshot) retries
+            _dirty_users.update(changed)
+            return
+        _wal_records += len(lines)
+
+        if _wal_records >= SNAPSHOT_EVERY or time.monotonic() - _last_snapshot >= SNAPSHOT_INTERVAL:
+            await save_data(users_data)
+            _wal_records = 0
+            _last_snapshot = time.monotonic()
+
+async def _saver_loop():
+    while True:
+        await _dirty.wait()
+        # Wait out the interval, or less if a large burst has already piled up
+        try:
+            await asyncio.wait_for(_batch_full.wait(), SAVE_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        await flush_data()
+
+@atexit.register
+def _final_save():
+    # Last-chance synchronous snapshot when the process exits
+    if _dirty_users:
+        _write_snapshot(users_data)
+
+# Per-user locks so concurrent commands from the same user run one at a time
+# instead of interleaving their read-modify-write of the user's record. Values
+# are weak, so a lock disappears once no running command holds or awaits it.
+_user_locks = weakref.WeakValueDictionary()
+
+def _lock(user_id):
+    return _user_locks.setdefault(str(user_id), asyncio.Lock())
+
+def locked_per_user(func):
+    """Runs a command while holding the invoking user's lock."""
+    @functools.wraps(func)
+    async def wrapper(ctx, *args, **kwargs):
+        async with _lock(ctx.author.id):
+            return await func(ctx, *args, **kwargs)
+    return wrapper
+
+# Fields every user record has; new users start from a copy of this
+_DEFAULT_USER = {
+    "balance": INITIAL_BALANCE,
+    "daily_last_claimed": 0,
+    "wins_flip": 0, "losses_flip": 0,
+    "wins_slot": 0, "losses_slot": 0,
+    "wins_bj": 0, "losses_bj": 0,
+    "total_gambled": 0,
+    "pray_streak": 0,
+    "last_pray_day": 0, # UTC day number (UNIX time // 86400)
+    "prays_today": 0,
+    "last_stole_date": 0, # Steal cooldown
+}
+
+def ensure_user_data(data, user_id):
+    """Returns the user's record from data, creating it if needed. Does no I/O."""
     user_id_str = str(user_id)
-    data = await load_data()
-    
-    if user_id_str not in data:
-        data[user_id_str] = {
-            "balance": INITIAL_BALANCE,
-            "daily_last_claimed": "0",
-            "wins_flip": 0, "losses_flip": 0,
-            "wins_slot": 0, "losses_slot": 0,
-            "wins_bj": 0, "losses_bj": 0,
-            "total_gambled": 0,
-            "pray_streak": 0,
-            "last_pray_date": "0",
-            "prays_today": 0,
-            "last_stole_date": "0", # New field for steal cooldown
-        }
-        await save_data(data)
+    user = data.get(user_id_str)
+    
+    if user is None:
+        user = data[user_id_str] = _DEFAULT_USER.copy()
+        balance_index.add((-INITIAL_BALANCE, user_id_str))
     else:
         # Migration for existing users (add missing fields)
-        defaults = {
-            "pray_streak": 0,
-            "last_pray_date": "0",
-            "prays_today": 0,
-            "last_stole_date": "0", # Add new default
-        }
-        changed = False
-        for key, val in defaults.items():
-            if key not in data[user_id_str]:
-                data[user_id_str][key] = val
-                changed = True
-        if changed:
-            await save_data(data)
+        missing = _DEFAULT_USER.keys() - user.keys()
+        if missing:
+            user.update({key: _DEFAULT_USER[key] for key in missing})
             
-    return data[user_id_str]
+    return user
+
+# Users with a positive balance as (-balance, user_id), richest first. Every
+# balance change goes through adjust_balance so the leaderboard never sorts.
+balance_index = SortedList()
+
+def adjust_balance(user_id, delta):
+    """Adds delta to a user's balance and keeps balance_index in step."""
+    user_id = str(user_id)
+    user_data = users_data[user_id]
+    old = user_data["balance"]
+    new = old + delta
+    user_data["balance"] = new
+    if old > 0:
+        balance_index.discard((-old, user_id))
+    if new > 0:
+        balance_index.add((-new, user_id))
+    return new
 
 # --- Events ---
 
+def load_state():
+    """Reads users and reminders from disk into memory."""
+    users_data.update(load_data())
+    balance_index.update((-d["balance"], uid) for uid, d in users_data.items() if d.get("balance", 0) > 0)
+    _reminders.extend(_read_reminders())
+    heapq.heapify(_reminders)
+    _reminder_counts.update(user_id for _, _, user_id, _ in _reminders)
+
+@bot.event
+async def setup_hook():
+    # Runs once before connecting, unlike on_ready which fires on every reconnect
+    # All blocking work is file I/O on one file, so a couple of threads is plenty
+    bot.loop.set_default_executor(ThreadPoolExecutor(max_workers=THREAD_POOL_SIZE, thread_name_prefix='kingcy-io'))
+    bot.saver_task = bot.loop.create_task(_saver_loop())
+    bot.reminder_task = bot.loop.create_task(_reminder_loop())
+    bot.web_runner = await start_web_server()
+    # Render stops the service with SIGTERM, which would otherwise skip atexit
+    try:
+        bot.loop.add_signal_handler(signal.SIGTERM, lambda: bot.loop.create_task(shutdown()))
+    except NotImplementedError:
+        pass # Not supported on Windows
+
+async def shutdown():
+    """Flushes unsaved changes and disconnects the bot."""
+    await flush_data()
+    await bot.web_runner.cleanup()
+    await bot.close()
+
+@bot.event
+async def on_disconnect():
+    await flush_data()
+
 @bot.event
 async def on_ready():
     print(f'{bot.user.name} is online!')
@@ -135,80 +423,73 @@ async def on_ready():
 
 # --- Commands ---
 
+# The help text never changes, so its embed is built once and reused
+_HELP_EMBED = discord.Embed(title="👑 Kingcy Bot Commands", color=0xFFD700)
+
+_HELP_EMBED.add_field(name="💰 Economy", value=(
+    "`king balance` - Check your funds\n"
+    "`king daily` - Claim daily reward\n"
+    "`king gift @user <amount>` - Give money to someone\n"
+    "`king claim <amount>` - (Admin/Special Role Only)\n"
+    "`king steal` - Attempt a risky heist!"
+), inline=False)
+
+_HELP_EMBED.add_field(name="🙏 Prayer & Luck", value=(
+    "`king pray` - Pray for luck (3x/day). Streaks give bonuses!\n"
+    "`king remind <time> <msg>` - Set a reminder (e.g., `king remind 4h Pray`)"
+), inline=False)
+
+_HELP_EMBED.add_field(name="🎰 Gambling", value=(
+    "`king flip <heads/tails> <amt>` - Coin flip (2x)\n"
+    "`king slot <amt>` - Slot machine (Animated!)\n"
+    "`king blackjack <amt>` - Play 21"
+), inline=False)
+
+_HELP_EMBED.add_field(name="🏆 Social", value=(
+    "`king leaderboard` - See who has the most Kingcy"
+), inline=False)
+
+_HELP_EMBED.set_footer(text="Prefix: king (e.g., 'king daily')")
+
 @bot.command(name='help')
 async def help_command(ctx):
     """Lists all available commands."""
-    embed = discord.Embed(title="👑 Kingcy Bot Commands", color=0xFFD700)
-    
-    embed.add_field(name="💰 Economy", value=(
-        "`king balance` - Check your funds\n"
-        "`king daily` - Claim daily reward\n"
-        "`king gift @user <amount>` - Give money to someone\n"
-        "`king claim <amount>` - (Admin/Special Role Only)\n"
-        "`king steal` - Attempt a risky heist!"
-    ), inline=False)
-    
-    embed.add_field(name="🙏 Prayer & Luck", value=(
-        "`king pray` - Pray for luck (3x/day). Streaks give bonuses!\n"
-        "`king remind <time> <msg>` - Set a reminder (e.g., `king remind 4h Pray`)"
-    ), inline=False)
-    
-    embed.add_field(name="🎰 Gambling", value=(
-        "`king flip <heads/tails> <amt>` - Coin flip (2x)\n"
-        "`king slot <amt>` - Slot machine (Animated!)\n"
-        "`king blackjack <amt>` - Play 21"
-    ), inline=False)
-    
-    embed.add_field(name="🏆 Social", value=(
-        "`king leaderboard` - See who has the most Kingcy"
-    ), inline=False)
-    
-    embed.set_footer(text="Prefix: king (e.g., 'king daily')")
-    await ctx.send(embed=embed)
+    await ctx.send(embed=_HELP_EMBED)
 
 # --- Economy ---
 
 @bot.command(name='balance', aliases=['bal'])
 async def balance(ctx):
-    user_id = str(ctx.author.id)
-    await ensure_user_data(user_id) # ensure data exists but reload fresh below
-    data = await load_data()
-    bal = data[user_id]["balance"]
+    # Read-only, so don't create a record for users who haven't played yet
+    user_data = users_data.get(str(ctx.author.id))
+    bal = user_data["balance"] if user_data else INITIAL_BALANCE
     
-    embed = discord.Embed(
-        description=f"💳 **{ctx.author.name}**, you have **{format_currency(bal)}**",
-        color=0x00FF00
-    )
+    embed = copy.copy(_BALANCE_EMBED)
+    embed.description = _BALANCE_TEXT(ctx.author.name, format_currency(bal))
     await ctx.send(embed=embed)
 
 @bot.command(name='daily')
+@locked_per_user
 async def daily(ctx):
-    user_id = str(ctx.author.id)
-    await ensure_user_data(user_id)
-    data = await load_data()
-    user_data = data[user_id]
+    user_data = ensure_user_data(users_data, ctx.author.id)
     
-    last_claimed = user_data.get("daily_last_claimed", "0")
+    last_claimed = user_data.get("daily_last_claimed", 0)
     
     # Check 24h cooldown
-    now = datetime.now(timezone.utc)
-    try:
-        last_date = datetime.fromisoformat(last_claimed)
-        if now < last_date + timedelta(hours=24):
-            remaining = (last_date + timedelta(hours=24)) - now
-            hours, remainder = divmod(remaining.seconds, 3600)
-            minutes, _ = divmod(remainder, 60)
-            return await ctx.send(f"⏳ Come back in **{hours}h {minutes}m**.")
-    except ValueError:
-        pass # If format error or "0", proceed
+    now = int(time.time())
+    ready_at = last_claimed + DAILY_COOLDOWN_SECONDS
+    if ready_at > now:
+        # Discord renders the relative time client-side and keeps it ticking
+        return await ctx.send(f"⏳ Come back {discord.utils.format_dt(datetime.fromtimestamp(ready_at, tz=timezone.utc), 'R')}.")
 
-    user_data["balance"] += DAILY_REWARD
-    user_data["daily_last_claimed"] = now.isoformat()
-    await save_data(data)
+    adjust_balance(ctx.author.id, DAILY_REWARD)
+    user_data["daily_last_claimed"] = now
+    schedule_save(ctx.author.id)
     
     await ctx.send(f"✅ **{ctx.author.name}**, you claimed your daily **{format_currency(DAILY_REWARD)}**!")
 
 @bot.command(name='gift', aliases=['pay'])
+@locked_per_user
 async def gift(ctx, recipient: discord.Member, amount: str):
     """Transfer money to another user."""
     if recipient.bot:
@@ -223,21 +504,16 @@ async def gift(ctx, recipient: discord.Member, amount: str):
     if amount <= 0:
         return await ctx.send("You must gift a positive amount.")
 
-    sender_id = str(ctx.author.id)
-    receiver_id = str(recipient.id)
-    
-    await ensure_user_data(sender_id)
-    await ensure_user_data(receiver_id)
-    
-    data = await load_data()
+    sender = ensure_user_data(users_data, ctx.author.id)
+    ensure_user_data(users_data, recipient.id)
     
-    if data[sender_id]["balance"] < amount:
-        return await ctx.send(f"❌ You don't have enough Kingcy. Balance: {format_currency(data[sender_id]['balance'])}")
+    if sender["balance"] < amount:
+        return await ctx.send(f"❌ You don't have enough Kingcy. Balance: {format_currency(sender['balance'])}")
     
-    data[sender_id]["balance"] -= amount
-    data[receiver_id]["balance"] += amount
+    adjust_balance(ctx.author.id, -amount)
+    adjust_balance(recipient.id, amount)
     
-    await save_data(data)
+    schedule_save(ctx.author.id, recipient.id)
     
     embed = discord.Embed(
         description=f"💸 **{ctx.author.name}** sent **{format_currency(amount)}** to **{recipient.name}**!",
@@ -246,6 +522,7 @@ async def gift(ctx, recipient: discord.Member, amount: str):
     await ctx.send(embed=embed)
 
 @bot.command(name='claim', aliases=['inviteclaim'])
+@locked_per_user
 async def claim(ctx, amount: str):
     """Exclusive command for a specific role to generate money."""
     user_id = str(ctx.author.id)
@@ -262,34 +539,25 @@ async def claim(ctx, amount: str):
     if amount <= 0:
         return await ctx.send("❌ Amount must be positive.")
 
-    await ensure_user_data(user_id)
-    data = await load_data()
+    ensure_user_data(users_data, user_id)
+    adjust_balance(user_id, amount)
     
-    data[user_id]["balance"] += amount
-    
-    await save_data(data)
+    schedule_save(ctx.author.id)
     await ctx.send(f"💎 **Exclusive Claim!** You generated **{format_currency(amount)}**!")
 
 @bot.command(name='steal')
+@locked_per_user
 async def steal(ctx):
     """Attempt a risky steal with a chance of being caught."""
-    user_id = str(ctx.author.id)
-    await ensure_user_data(user_id)
-    data = await load_data()
-    user_data = data[user_id]
+    user_data = ensure_user_data(users_data, ctx.author.id)
     
-    now = datetime.now(timezone.utc)
-    last_stole = user_data.get("last_stole_date", "0")
+    now = int(time.time())
+    last_stole = user_data.get("last_stole_date", 0)
     
     # Check for Steal Cooldown (only applies if they were previously caught)
-    try:
-        last_date = datetime.fromisoformat(last_stole)
-        if now < last_date + timedelta(minutes=STEAL_COOLDOWN_MINUTES):
-            remaining = (last_date + timedelta(minutes=STEAL_COOLDOWN_MINUTES)) - now
-            minutes, seconds = divmod(remaining.seconds, 60)
-            return await ctx.send(f"🚨 You are wanted! You must wait **{minutes}m {seconds}s** before trying to steal again.")
-    except ValueError:
-        pass # If format error or "0", proceed
+    ready_at = last_stole + STEAL_COOLDOWN_MINUTES * 60
+    if ready_at > now:
+        return await ctx.send(f"🚨 You are wanted! You can try to steal again {discord.utils.format_dt(datetime.fromtimestamp(ready_at, tz=timezone.utc), 'R')}.")
     
     # --- STEAL MECHANICS ---
     
@@ -311,7 +579,7 @@ async def steal(ctx):
         # CAUGHT!
         
         # 1. Cooldown penalty
-        user_data["last_stole_date"] = (now + timedelta(minutes=STEAL_COOLDOWN_MINUTES)).isoformat()
+        user_data["last_stole_date"] = now + STEAL_COOLDOWN_MINUTES * 60
         
         # 2. Luck penalty (Reset pray streak)
         old_streak = user_data.get("pray_streak", 0)
@@ -319,10 +587,9 @@ async def steal(ctx):
         
         # 3. Monetary Penalty (Lose the amount that would have been stolen)
         lost_amount = stolen_amount
-        user_data["balance"] -= lost_amount
-        user_data["balance"] = max(0, user_data["balance"]) # Cannot go below zero
+        adjust_balance(ctx.author.id, -min(lost_amount, user_data["balance"])) # Cannot go below zero
 
-        await save_data(data)
+        schedule_save(ctx.author.id)
         
         caught_embed = discord.Embed(
             title="🚔 BUSTED!",
@@ -339,10 +606,10 @@ async def steal(ctx):
         # SUCCESS!
         
         # 1. Reward
-        user_data["balance"] += stolen_amount
-        user_data["last_stole_date"] = "0" # Clear cooldown if successful
+        adjust_balance(ctx.author.id, stolen_amount)
+        user_data["last_stole_date"] = 0 # Clear cooldown if successful
 
-        await save_data(data)
+        schedule_save(ctx.author.id)
         
         success_embed = discord.Embed(
             title="💵 HEIST SUCCESSFUL!",
@@ -355,26 +622,22 @@ async def steal(ctx):
 # --- Prayer System ---
 
 @bot.command(name='pray')
+@locked_per_user
 async def pray(ctx):
-    user_id = str(ctx.author.id)
-    await ensure_user_data(user_id)
-    data = await load_data()
-    user = data[user_id]
+    user = ensure_user_data(users_data, ctx.author.id)
     
-    now = datetime.now(timezone.utc)
-    today_str = now.strftime("%Y-%m-%d")
-    yesterday_str = (now - timedelta(days=1)).strftime("%Y-%m-%d")
+    today = int(time.time()) // 86400 # UTC day number
     
-    last_pray_date = user.get("last_pray_date", "0").split("T")[0] # Just get the date part
+    last_pray_day = user.get("last_pray_day", 0)
     prays_today = user.get("prays_today", 0)
     streak = user.get("pray_streak", 0)
 
     # Check reset
-    if last_pray_date != today_str:
+    if last_pray_day != today:
         prays_today = 0
         # Streak logic: if missed yesterday, reset
-        # Check against a date component only (no time consideration for streak break)
-        if last_pray_date != yesterday_str and last_pray_date != "0":
+        # Check against the day number only (no time consideration for streak break)
+        if last_pray_day != today - 1 and last_pray_day:
             streak = 0
             await ctx.send("💔 You missed a day! Your prayer streak has been reset.")
 
@@ -385,9 +648,9 @@ async def pray(ctx):
     bonus = streak * 10
     total_reward = PRAY_REWARD_BASE + bonus
     
-    user["balance"] += total_reward
+    adjust_balance(ctx.author.id, total_reward)
     user["prays_today"] = prays_today + 1
-    user["last_pray_date"] = now.isoformat()
+    user["last_pray_day"] = today
     
     # Increment streak only on the FIRST pray of the day
     if prays_today == 0:
@@ -397,198 +660,272 @@ async def pray(ctx):
     else:
         streak_msg = ""
 
-    await save_data(data)
+    schedule_save(ctx.author.id)
     
-    embed = discord.Embed(
-        description=f"🙏 **{ctx.author.name}** prayed.\nreceived **{format_currency(total_reward)}** (Luck Bonus: +{bonus})\n{streak_msg}",
-        color=0xFFFFFF
-    )
+    embed = copy.copy(_PRAY_EMBED)
+    embed.description = f"🙏 **{ctx.author.name}** prayed.\nreceived **{format_currency(total_reward)}** (Luck Bonus: +{bonus})\n{streak_msg}"
     await ctx.send(embed=embed)
 
+# --- Reminders ---
+# Pending reminders are a heap of (due, channel_id, user_id, message) saved to
+# REMINDERS_FILE, so they survive restarts and one task sleeps until the
+# earliest is due instead of one sleeping task per reminder.
+
+_reminders = []
+_reminder_counts = Counter() # Pending reminders per user id
+_reminders_changed = asyncio.Event() # Needs Python 3.10+, see _dirty
+_reminders_lock = asyncio.Lock()
+
+def _read_reminders():
+    if not os.path.exists(REMINDERS_FILE):
+        return []
+    try:
+        with open(REMINDERS_FILE, 'rb') as f:
+            return [tuple(r) for r in _loads(f.read())]
+    except:
+        return []
+
+def _write_reminders(reminders):
+    tmp_file = REMINDERS_FILE + ".tmp"
+    with open(tmp_file, 'wb') as f:
+        f.write(_dumps(reminders))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_file, REMINDERS_FILE)
+
+async def save_reminders():
+    async with _reminders_lock:
+        try:
+            await asyncio.to_thread(_write_reminders, list(_reminders))
+        except Exception as e:
+            print(f"Error saving reminders: {e}")
+
+async def _reminder_loop():
+    await bot.wait_until_ready() # Channels aren't cached until then
+    while True:
+        _reminders_changed.clear()
+        timeout = None
+        if _reminders:
+            timeout = _reminders[0][0] - time.time()
+            if timeout <= 0:
+                _, channel_id, user_id, message = heapq.heappop(_reminders)
+                _reminder_counts[user_id] -= 1
+                if not _reminder_counts[user_id]:
+                    del _reminder_counts[user_id]
+                text = f"🔔 <@{user_id}>, Reminder: **{message}**"
+                try:
+                    # DM channels and uncached channels aren't in the cache after a restart
+                    channel = bot.get_channel(channel_id) or await bot.fetch_channel(channel_id)
+                    await channel.send(text)
+                except Exception:
+                    # Channel deleted, no longer writable or unreachable; DM the user instead
+                    try:
+                        user = await bot.fetch_user(user_id)
+                        await user.send(text)
+                    except Exception as e:
+                        # Network errors too, so one failure can't kill the scheduler
+                        print(f"Error delivering reminder to {user_id}: {e}")
+                await save_reminders()
+                continue
+        # Sleep until the earliest reminder is due or a new one is added
+        try:
+            await asyncio.wait_for(_reminders_changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+# Reminder durations like 1h, 10m, 30s
+_TIME_RE = re.compile(r"(\d+)([hms])$")
+_UNITS = {'h': 3600, 'm': 60, 's': 1}
+
 @bot.command(name='remind')
 async def remind(ctx, time_str: str, *, message: str="Something important!"):
     """Set a reminder. Usage: king remind 10m Check slots"""
-    # Simple regex to parse 1h, 10m, 30s
-    match = re.match(r"(\d+)([hms])", time_str)
+    match = _TIME_RE.match(time_str)
     if not match:
         return await ctx.send("❌ Invalid time format. Use `1h`, `30m`, or `10s`.")
     
-    amount = int(match.group(1))
-    unit = match.group(2)
+    seconds = int(match.group(1)) * _UNITS[match.group(2)]
     
-    seconds = 0
-    if unit == 'h': seconds = amount * 3600
-    elif unit == 'm': seconds = amount * 60
-    elif unit == 's': seconds = amount
+    if _reminder_counts[ctx.author.id] >= MAX_REMINDERS_PER_USER:
+        return await ctx.send(f"❌ You already have {MAX_REMINDERS_PER_USER} reminders pending.")
     
     if seconds > 86400: # Cap at 24h
         return await ctx.send("❌ Reminder cannot be longer than 24 hours.")
 
+    # Queue before awaiting anything so concurrent calls can't slip past the cap
+    heapq.heappush(_reminders, (time.time() + seconds, ctx.channel.id, ctx.author.id, message))
+    _reminder_counts[ctx.author.id] += 1
+    _reminders_changed.set()
+
+    await save_reminders()
     await ctx.send(f"⏰ I will remind you to **\"{message}\"** in **{time_str}**.")
-    
-    await asyncio.sleep(seconds)
-    
-    await ctx.send(f"🔔 {ctx.author.mention}, Reminder: **{message}**")
 
 # --- Gambling (Animated & Updated) ---
 
-async def check_bet(ctx, amount):
-    """Checks if the bet is valid (positive integer, sufficient funds)."""
+def settle_bet(user_id, user_data, game, bet, payout):
+    """Pays out a finished bet for a game ("flip", "slot" or "bj") and records it.
+
+    The stake has already been taken, so payout is what goes back to the
+    player; a push (payout == bet) counts as neither a win nor a loss.
+    """
+    adjust_balance(user_id, payout)
+    user_data["total_gambled"] += bet
+    if payout > bet:
+        user_data[f"wins_{game}"] += 1
+    elif payout < bet:
+        user_data[f"losses_{game}"] += 1
+    schedule_save(user_id)
+
+# Game outcomes come from the OS CSPRNG so they can't be predicted from earlier results
+_RNG = random.SystemRandom()
+
+SLOT_EMOJIS = ('🍒', '🔔', '💎', '💰', '👑')
+
+# Blackjack card values by rank (2-10, J, Q, K, A); aces count 11 until they bust the hand
+CARD_VALUES = bytes([2, 3, 4, 5, 6, 7, 8, 9, 10, 10, 10, 10, 11])
+ACE = CARD_VALUES[-1]
+DECK = tuple(CARD_VALUES) * 4
+# 2 player cards + the longest possible dealer hand (A,A,A,A,2,2,2,2,3,3)
+CARDS_PER_GAME = 12
+
+def calculate_hand_value(hand):
+    """Scores a blackjack hand, dropping aces from 11 to 1 while it's over 21."""
+    value = sum(hand)
+    # Each demoted ace takes off 10, so demote just enough to cover the excess
+    demoted = min(hand.count(ACE), (max(value - 21, 0) + 9) // 10)
+    return value - 10 * demoted
+
+def place_bet(user_id, amount):
+    """Checks if the bet is valid (positive integer, sufficient funds) and takes the stake.
+
+    Returns (user_data, bet, None) once the stake is taken, or
+    (user_data, 0, error message) if the bet is rejected.
+    """
+    user_data = ensure_user_data(users_data, user_id)
     try:
-        amount = int(amount)
-    except:
-        await ctx.send("Please enter a valid number.")
-        return False, 0
+        bet = int(amount)
+    except ValueError:
+        return user_data, 0, "Please enter a valid number."
     
-    if amount <= 0:
-        await ctx.send("Bet must be positive.")
-        return False, 0
+    if bet <= 0:
+        return user_data, 0, "Bet must be positive."
         
-    user_id = str(ctx.author.id)
-    await ensure_user_data(user_id) # Ensure data is loaded
-    data = await load_data()
-    
-    if user_id not in data or data[user_id]["balance"] < amount:
-        await ctx.send(f"❌ Insufficient funds. You only have {format_currency(data[user_id]['balance'])}.")
-        return False, 0
+    if user_data["balance"] < bet:
+        return user_data, 0, f"❌ Insufficient funds. You only have {format_currency(user_data['balance'])}."
         
-    return True, amount
+    adjust_balance(user_id, -bet)
+    schedule_save(user_id)
+    return user_data, bet, None
 
 @bot.command(name='slot', aliases=['slots'])
+@locked_per_user
 async def slot(ctx, amount: str):
-    # This check now handles the insufficient funds issue
-    valid, bet = await check_bet(ctx, amount) 
-    if not valid: return
-
-    # Deduct bet ONLY IF VALID
-    user_id = str(ctx.author.id)
-    data = await load_data()
-    data[user_id]["balance"] -= bet
-    await save_data(data)
+    user_data, bet, error = place_bet(ctx.author.id, amount)
+    if error: return await ctx.send(error)
 
-    emojis = ['🍒', '🔔', '💎', '💰', '👑']
-    
     # Initial message
-    embed = discord.Embed(title="🎰 Slot Machine", description="🔄 Spinning...\n\n| ❓ | ❓ | ❓ |", color=0x3498db)
+    embed = copy.copy(_SLOT_EMBED)
     msg = await ctx.send(embed=embed)
     
-    # Animation Loop
+    # Animation Loop: frames are sent in the background so the delays overlap
+    # the edit round trips instead of adding to them
+    frames = []
     for _ in range(3):
         await asyncio.sleep(0.7)
-        s1, s2, s3 = random.choice(emojis), random.choice(emojis), random.choice(emojis)
+        s1, s2, s3 = random.choices(SLOT_EMOJIS, k=3)
         embed.description = f"🔄 Spinning...\n\n| {s1} | {s2} | {s3} |"
-        await msg.edit(embed=embed)
+        frames.append(asyncio.create_task(msg.edit(embed=copy.copy(embed))))
     
     # Final Result
     await asyncio.sleep(0.5)
-    s1, s2, s3 = random.choice(emojis), random.choice(emojis), random.choice(emojis)
+    # Don't let a late animation frame overwrite the result
+    await asyncio.gather(*frames, return_exceptions=True)
+    s1, s2, s3 = _RNG.choices(SLOT_EMOJIS, k=3)
     
-    winnings = 0
-    result_text = ""
-    color = 0x000000
+    # Number of distinct symbols: 1 = all three match, 2 = a pair, 3 = no match
+    unique = len({s1, s2, s3})
     
-    if s1 == s2 == s3:
-        winnings = bet * 10
+    if unique == 1:
+        multiplier = 10
         result_text = "🎉 **JACKPOT! (10x)**"
         color = 0xF1C40F # Gold
-        data[user_id]["wins_slot"] += 1
-    elif s1 == s2 or s2 == s3 or s1 == s3:
-        winnings = bet * 2
+    elif unique == 2:
+        multiplier = 2
         result_text = "✨ **Double Match! (2x)**"
         color = 0xE67E22 # Orange
-        data[user_id]["wins_slot"] += 1
     else:
+        multiplier = 0
         result_text = "💸 **You Lost.**"
         color = 0xE74C3C # Red
-        data[user_id]["losses_slot"] += 1
 
-    data[user_id]["balance"] += winnings
-    data[user_id]["total_gambled"] += bet
-    await save_data(data)
+    winnings = bet * multiplier
+    settle_bet(ctx.author.id, user_data, "slot", bet, winnings)
     
     embed.title = "🎰 Slot Machine Result"
     embed.description = f"| {s1} | {s2} | {s3} |\n\n{result_text}\nWon: {format_currency(winnings)}"
     embed.color = color
-    embed.set_footer(text=f"New Balance: {format_currency(data[user_id]['balance'])}")
+    embed.set_footer(text=f"New Balance: {format_currency(user_data['balance'])}")
     
     await msg.edit(embed=embed)
 
 @bot.command(name='flip', aliases=['cf'])
+@locked_per_user
 async def flip(ctx, choice: str, amount: str):
-    valid, bet = await check_bet(ctx, amount)
-    if not valid: return
-    
     choice = choice.lower()
     if choice not in ['heads', 'tails', 'h', 't']:
         return await ctx.send("Please pick `heads` or `tails`.")
+
+    user_data, bet, error = place_bet(ctx.author.id, amount)
+    if error: return await ctx.send(error)
         
     if choice == 'h': choice = 'heads'
     if choice == 't': choice = 'tails'
 
-    user_id = str(ctx.author.id)
-    data = await load_data()
-    
-    result = random.choice(['heads', 'tails'])
+    result = 'heads' if _RNG.getrandbits(1) else 'tails'
     
     if choice == result:
-        winnings = bet # Profit
-        data[user_id]["balance"] += winnings
-        data[user_id]["wins_flip"] += 1
-        msg = f"🎉 It's **{result.upper()}**! You won **{format_currency(winnings)}**!"
-        col = 0x2ECC71
+        payout = bet * 2 # Stake back plus an equal profit
+        msg = f"🎉 It's **{result.upper()}**! You won **{format_currency(bet)}**!"
+        template = _FLIP_WIN_EMBED
     else:
-        data[user_id]["balance"] -= bet
-        data[user_id]["losses_flip"] += 1
+        payout = 0
         msg = f"💀 It's **{result.upper()}**! You lost **{format_currency(bet)}**."
-        col = 0xE74C3C
+        template = _FLIP_LOSS_EMBED
         
-    data[user_id]["total_gambled"] += bet
-    await save_data(data)
+    settle_bet(ctx.author.id, user_data, "flip", bet, payout)
     
-    embed = discord.Embed(title="🪙 Coin Flip", description=msg, color=col)
-    embed.set_footer(text=f"New Balance: {format_currency(data[user_id]['balance'])}")
+    embed = copy.copy(template)
+    embed.description = msg
+    embed.set_footer(text=f"New Balance: {format_currency(user_data['balance'])}")
     await ctx.send(embed=embed)
 
 @bot.command(name='blackjack', aliases=['bj'])
+@locked_per_user
 async def blackjack(ctx, amount: str):
-    valid, bet = await check_bet(ctx, amount)
-    if not valid: return
+    user_data, bet, error = place_bet(ctx.author.id, amount)
+    if error: return await ctx.send(error)
 
-    user_id = str(ctx.author.id)
-    data = await load_data()
-    data[user_id]["balance"] -= bet
-    await save_data(data)
+    # Only draw the cards a game can use instead of shuffling the full deck
+    cards = _RNG.sample(DECK, CARDS_PER_GAME)
+    player_hand = cards[0:2]
+    dealer_hand = cards[2:4]
+    draw_idx = 4
 
-    deck = [2,3,4,5,6,7,8,9,10,10,10,10,11] * 4
-    random.shuffle(deck)
-    
-    player_hand = [deck.pop(), deck.pop()]
-    dealer_hand = [deck.pop(), deck.pop()]
-    
-    def score(hand):
-        s = sum(hand)
-        aces = hand.count(11)
-        while s > 21 and aces:
-            s -= 10
-            aces -= 1
-        return s
-
-    p_score = score(player_hand)
-    d_score = score(dealer_hand)
+    p_score = calculate_hand_value(player_hand)
+    d_score = calculate_hand_value(dealer_hand)
     
     # Instant Blackjack Check
     if p_score == 21:
         win = int(bet * 2.5) # 1.5x payout + bet back
-        data[user_id]["balance"] += win
-        data[user_id]["wins_bj"] += 1
-        await save_data(data)
+        settle_bet(ctx.author.id, user_data, "bj", bet, win)
         return await ctx.send(embed=discord.Embed(title="🃏 Blackjack!", description=f"**Blackjack!** You won **{format_currency(win)}**!", color=0xF1C40F))
 
     # Simplified logic (No hit/stand interaction for simplicity in text command)
     # Dealer plays out immediately
     while d_score < 17:
-        dealer_hand.append(deck.pop())
-        d_score = score(dealer_hand)
+        dealer_hand.append(cards[draw_idx])
+        draw_idx += 1
+        d_score = calculate_hand_value(dealer_hand)
         
     # Determine winner
     winnings = 0
@@ -611,51 +948,70 @@ async def blackjack(ctx, amount: str):
         res = "Dealer wins."
         col = 0xE74C3C
         
-    data[user_id]["balance"] += winnings
-    data[user_id]["total_gambled"] += bet
-    if winnings > bet: data[user_id]["wins_bj"] += 1
-    elif winnings < bet: data[user_id]["losses_bj"] += 1
-    
-    await save_data(data)
+    settle_bet(ctx.author.id, user_data, "bj", bet, winnings)
 
     embed = discord.Embed(title="🃏 Blackjack", color=col)
     embed.add_field(name="You", value=f"{player_hand} ({p_score})")
     embed.add_field(name="Dealer", value=f"{dealer_hand} ({d_score})")
     embed.add_field(name="Result", value=res, inline=False)
-    embed.set_footer(text=f"Balance: {format_currency(data[user_id]['balance'])}")
+    embed.set_footer(text=f"Balance: {format_currency(user_data['balance'])}")
     await ctx.send(embed=embed)
 
+# Names of users outside the guild member cache as (name, expiry), least
+# recently used first. Failed lookups are cached too so they aren't retried
+# on every leaderboard.
+_name_cache = OrderedDict()
+
+async def resolve_user_name(user_id):
+    """Looks up a user's name from the client cache, falling back to the API."""
+    now = time.monotonic()
+    cached = _name_cache.get(user_id)
+    if cached and cached[1] > now:
+        name = cached[0]
+    else:
+        user = bot.get_user(int(user_id))
+        if user is None:
+            try:
+                user = await bot.fetch_user(int(user_id))
+            except discord.HTTPException:
+                user = None
+        name = user.name if user else f"User#{user_id[-4:]}"
+        cached = (name, now + NAME_CACHE_TTL)
+    _name_cache[user_id] = cached
+    _name_cache.move_to_end(user_id)
+    if len(_name_cache) > NAME_CACHE_SIZE:
+        _name_cache.popitem(last=False)
+    return name
+
 @bot.command(name='leaderboard', aliases=['lb'])
 async def leaderboard(ctx):
-    data = await load_data()
-    sorted_users = sorted(
-        [(uid, d) for uid, d in data.items() if d.get('balance', 0) > 0],
-        key=lambda x: x[1]['balance'],
-        reverse=True
-    )
-
-    lb_text = ""
-    count = 0
+    entries = []
     
-    for uid, user_data in sorted_users:
-        if count >= 10: break
+    # balance_index is already ordered richest first
+    for neg_balance, uid in balance_index:
+        if len(entries) >= LEADERBOARD_SIZE: break
         
         # Check for excluded role
-        try:
-            member = ctx.guild.get_member(int(uid))
-            if member:
-                # Check if member has the excluded role
-                if any(r.id == EXCLUDED_ROLE_ID for r in member.roles):
-                    continue # Skip this user
-                name = member.name
-            else:
-                # If member left server, we show them (optional) or skip
-                name = f"User#{uid[-4:]}"
-        except:
-            name = f"User#{uid[-4:]}"
+        # No guild in DMs, so every name is resolved below
+        member = ctx.guild.get_member(int(uid)) if ctx.guild else None
+        if member:
+            # get_role bisects the member's sorted role ids instead of scanning them
+            if member.get_role(EXCLUDED_ROLE_ID):
+                continue # Skip this user
+            name = member.name
+        else:
+            # Member left the server; resolve their name below
+            name = None
+
+        entries.append((uid, name, -neg_balance))
 
-        count += 1
-        lb_text += f"**{count}.** {name} • **{format_currency(user_data['balance'])}**\n"
+    # Resolve everyone who isn't in the guild cache concurrently
+    missing = [uid for uid, name, _ in entries if name is None]
+    resolved = dict(zip(missing, await asyncio.gather(*(resolve_user_name(uid) for uid in missing))))
+
+    lb_text = ""
+    for rank, (uid, name, bal) in enumerate(entries, start=1):
+        lb_text += f"**{rank}.** {name or resolved[uid]} • **{format_currency(bal)}**\n"
 
     if not lb_text:
         lb_text = "No one is on the leaderboard yet!"
@@ -664,12 +1020,16 @@ async def leaderboard(ctx):
     await ctx.send(embed=embed)
 
 # --- Startup ---
+async def main():
+    """Loads saved state and runs the bot; setup_hook starts the background tasks."""
+    discord.utils.setup_logging() # bot.run did this for us
+    # Nothing else is running yet, so read synchronously rather than via a thread
+    load_state()
+    async with bot:
+        await bot.start(TOKEN)
+
 if __name__ == "__main__":
     if TOKEN == 'YOUR_BOT_TOKEN_HERE':
         print("ERROR: Set DISCORD_TOKEN env variable.")
     else:
-        # Start the Flask server in a separate thread
-        server_thread = Thread(target=run_flask_server, daemon=True)
-        server_thread.start()
-        # Run the Discord bot
-        bot.run(TOKEN)
+        asyncio.run(main())